@@ -5,15 +5,22 @@ X-axis: 0-1000 m · Y-axis: chunks · Bars at stretch chainages · Overlap analy
 
 import re
 import base64
+import hashlib
 import io
-from datetime import datetime
+import json
+import os
+import pickle
+from dataclasses import dataclass, replace
 from pathlib import Path
-from typing import Optional, Tuple
 
 import dash
 from dash import dcc, html, callback, Input, Output, State, dash_table
+from dash.exceptions import PreventUpdate
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
+import plotly.io as pio
+from flask_caching import Cache
 
 CHUNK_SIZE = 1000
 LAYER_COLORS = {
@@ -21,36 +28,71 @@ LAYER_COLORS = {
     "Embankment EW": "#8957e5",
 }
 DEFAULT_COLORS = ["#238636", "#8957e5", "#1f6feb", "#d29922", "#db61a2"]
+_STRETCH_RE = re.compile(r"^(\d+)\s*-\s*(\d+)$")
+_DATE_FORMATS = ("%d.%m.%Y", "%d.%m.%y", "%d-%m-%Y", "%Y-%m-%d")
+_MONTH_ABBR = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
 
 app = dash.Dash(__name__, title="Layer Coverage Viewer")
 server = app.server
+# Set REDIS_URL to share the cache between worker processes; otherwise it is kept in memory.
+cache = Cache(server, config={
+    "CACHE_TYPE": "RedisCache" if os.getenv("REDIS_URL") else "SimpleCache",
+    "CACHE_REDIS_URL": os.getenv("REDIS_URL", ""),
+    "CACHE_DEFAULT_TIMEOUT": 3600,
+})
+
+
+@dataclass(eq=False, repr=False)
+class Records:
+    """Parsed CSV rows as parallel arrays; *_ids index into the sorted *_names lists (-1 = blank)."""
+
+    starts: np.ndarray
+    ends: np.ndarray
+    layer_ids: np.ndarray
+    bill_ids: np.ndarray
+    month_ids: np.ndarray
+    layer_names: list
+    bill_names: list
+    month_names: list
+    route_extent: int
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def _key(self) -> tuple:
+        return (
+            self.starts.tobytes(), self.ends.tobytes(), self.layer_ids.tobytes(),
+            self.bill_ids.tobytes(), self.month_ids.tobytes(),
+            tuple(self.layer_names), tuple(self.bill_names), tuple(self.month_names), self.route_extent,
+        )
 
-
-def parse_date(s: str) -> Optional[datetime]:
-    if not s or not isinstance(s, str):
-        return None
-    s = str(s).strip()
-    for fmt in ("%d.%m.%Y", "%d.%m.%y", "%d-%m-%Y", "%Y-%m-%d"):
-        try:
-            return datetime.strptime(s, fmt)
-        except ValueError:
-            continue
-    return None
+    def __caching_id__(self) -> str:
+        return hashlib.blake2b(pickle.dumps(self._key()), digest_size=16).hexdigest()
+
+    def __repr__(self) -> str:
+        # cache.memoize keys plain arguments by repr(), and the default repr elides the middle of each array.
+        return f"Records({self.__caching_id__()})"
+
+    def subset(self, mask: np.ndarray) -> "Records":
+        return replace(
+            self,
+            starts=self.starts[mask],
+            ends=self.ends[mask],
+            layer_ids=self.layer_ids[mask],
+            bill_ids=self.bill_ids[mask],
+            month_ids=self.month_ids[mask],
+        )
 
 
-def parse_stretch(s: str) -> Optional[Tuple[int, int]]:
-    if not s or not isinstance(s, str):
-        return None
-    m = re.match(r"^(\d+)\s*-\s*(\d+)$", str(s).strip())
-    if not m:
-        return None
-    start, end = int(m[1]), int(m[2])
-    return (start, end) if start <= end else None
+def _codes(values: np.ndarray) -> tuple[np.ndarray, list]:
+    codes, names = pd.factorize(np.where(values == "", None, values), sort=True)
+    return codes.astype(np.int32), names.tolist()
 
 
-def parse_csv(content: str):
-    df = pd.read_csv(io.StringIO(content))
-    cols = [c for c in df.columns if c]
+@cache.memoize()
+def parse_csv(content: str) -> Records:
+    header = pd.read_csv(io.StringIO(content), nrows=0)
+    cols = [c for c in header.columns if c]
     lower = [str(c).lower() for c in cols]
     item_idx = next((i for i, c in enumerate(lower) if c in ("item", "layer")), -1)
     stretch_idx = next((i for i, c in enumerate(lower) if c in ("stretch", "chainage")), -1)
@@ -59,124 +101,181 @@ def parse_csv(content: str):
     date_idx = next((i for i, c in enumerate(lower) if c in ("date", "end date")), -1)
     if item_idx < 0 or stretch_idx < 0:
         raise ValueError('CSV must have "Item" (or Layer) and "Stretch" columns')
-    records = []
+    used = [cols[i] for i in (item_idx, stretch_idx, bill_idx, est_idx, date_idx) if i >= 0]
+    df = pd.read_csv(io.StringIO(content), usecols=used, dtype=str, engine="c")
+    n = len(df)
+
+    def text_column(idx: int) -> np.ndarray:
+        if idx < 0:
+            return np.full(n, "", dtype=object)
+        return df[cols[idx]].fillna("").str.strip().to_numpy()
+
+    items = text_column(item_idx)
+    bills = text_column(bill_idx)
+    months = np.full(n, "", dtype=object)
+    if date_idx >= 0:
+        date_text = df[cols[date_idx]].fillna("").str.strip()
+        dates = pd.to_datetime(date_text, format=_DATE_FORMATS[0], errors="coerce")
+        for fmt in _DATE_FORMATS[1:]:
+            dates = dates.fillna(pd.to_datetime(date_text, format=fmt, errors="coerce"))
+        # pandas accepts year 0 (e.g. a "0000-01-01" placeholder) but strptime and strftime do not.
+        dates = dates.where(dates.dt.year >= 1)
+        months = dates.dt.strftime("%Y-%m").fillna("").to_numpy()
+    if est_idx >= 0:
+        est_text = df[cols[est_idx]].str.replace(",", "", regex=False)
+        ests = pd.to_numeric(est_text, errors="coerce").fillna(0).astype(int).to_numpy()
+    else:
+        ests = np.zeros(n, dtype=int)
+    spans = df[cols[stretch_idx]].fillna("").str.strip().str.extract(_STRETCH_RE)
+    starts = pd.to_numeric(spans[0], errors="coerce")
+    ends = pd.to_numeric(spans[1], errors="coerce")
+    valid = (starts.notna() & ends.notna() & (starts <= ends)).to_numpy() & (items != "")
+    starts = starts.fillna(0).astype("int64").to_numpy()
+    ends = ends.fillna(0).astype("int64").to_numpy()
+    layer_ids, layer_names = _codes(items[valid])
+    bill_ids, bill_names = _codes(bills[valid])
+    month_ids, month_names = _codes(months[valid])
+    starts, ends = starts[valid], ends[valid]
     route_extent = 0
-    for _, row in df.iterrows():
-        item = str(row.iloc[item_idx] or "").strip()
-        stretch = str(row.iloc[stretch_idx] or "").strip()
-        if not item or not stretch:
-            continue
-        span = parse_stretch(stretch)
-        if not span:
-            continue
-        rec = {"layer": item, "start": span[0], "end": span[1]}
-        if bill_idx >= 0:
-            bill = str(row.iloc[bill_idx] or "").strip()
-            if bill:
-                rec["bill"] = bill
-        if est_idx >= 0:
-            try:
-                est = int(str(row.iloc[est_idx] or "0").replace(",", ""))
-                if est > 0:
-                    route_extent = est
-            except (ValueError, TypeError):
-                pass
-        if date_idx >= 0:
-            dt = parse_date(str(row.iloc[date_idx] or ""))
-            if dt:
-                rec["month"] = f"{dt.year}-{dt.month:02d}"
-        records.append(rec)
-    if not route_extent and records:
-        route_extent = max(r["end"] for r in records) - min(r["start"] for r in records)
-    return records, route_extent or 8000
-
-
-def build_stretch_segments(records: list[dict]) -> dict:
-    segments = []
-    layers = set()
-    chunks = set()
-
-    for r in records:
-        layers.add(r["layer"])
-        c_start = (r["start"] // CHUNK_SIZE) * CHUNK_SIZE
-        c_end = (r["end"] // CHUNK_SIZE) * CHUNK_SIZE
-        c = c_start
-        while c <= c_end:
-            chunks.add(c)
-            seg_start = max(r["start"], c)
-            seg_end = min(r["end"], c + CHUNK_SIZE)
-            if seg_start < seg_end:
-                rel_start = seg_start - c
-                rel_end = seg_end - c
-                segments.append({
-                    "chunk_start": c,
-                    "chunk_label": f"{c}-{c + CHUNK_SIZE}",
-                    "layer": r["layer"],
-                    "rel_start": rel_start,
-                    "rel_end": rel_end,
-                    "abs_start": seg_start,
-                    "abs_end": seg_end,
-                })
-            c += CHUNK_SIZE
-
-    segments.sort(key=lambda s: (s["chunk_start"], s["layer"], s["rel_start"]))
-    layers = sorted(layers)
-    chunks = sorted(chunks)
+    if len(starts):
+        given = ests[valid]
+        given = given[given > 0]
+        route_extent = int(given[-1]) if len(given) else int(ends.max() - starts.min())
+    return Records(
+        starts=starts,
+        ends=ends,
+        layer_ids=layer_ids,
+        bill_ids=bill_ids,
+        month_ids=month_ids,
+        layer_names=layer_names,
+        bill_names=bill_names,
+        month_names=month_names,
+        route_extent=route_extent or 8000,
+    )
+
+
+def build_stretch_segments(records: Records) -> dict:
+    if not len(records):
+        return {"segments": [], "layers": [], "chunks": []}
+    starts, ends = records.starts, records.ends
+    present, layer_ids = np.unique(records.layer_ids, return_inverse=True)
+    layers = [records.layer_names[i] for i in present.tolist()]
+
+    # Expand each record into one row per chunk it touches.
+    c_start = (starts // CHUNK_SIZE) * CHUNK_SIZE
+    c_end = (ends // CHUNK_SIZE) * CHUNK_SIZE
+    lengths = (c_end - c_start) // CHUNK_SIZE + 1
+    rec_idx = np.repeat(np.arange(len(records)), lengths)
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    c = c_start[rec_idx] + offsets * CHUNK_SIZE
+    chunks = np.unique(c).tolist()
+
+    seg_start = np.maximum(starts[rec_idx], c)
+    seg_end = np.minimum(ends[rec_idx], c + CHUNK_SIZE)
+    keep = seg_start < seg_end
+    c, seg_start, seg_end, seg_layer = c[keep], seg_start[keep], seg_end[keep], layer_ids[rec_idx][keep]
+    order = np.lexsort((seg_start - c, seg_layer, c))
+
+    segments = [
+        {
+            "chunk_start": cs,
+            "chunk_label": f"{cs}-{cs + CHUNK_SIZE}",
+            "layer": layers[li],
+            "rel_start": s - cs,
+            "rel_end": e - cs,
+            "abs_start": s,
+            "abs_end": e,
+        }
+        for cs, li, s, e in zip(c[order].tolist(), seg_layer[order].tolist(), seg_start[order].tolist(), seg_end[order].tolist())
+    ]
     return {"segments": segments, "layers": layers, "chunks": chunks}
 
 
-def merge_intervals(intervals: list[dict]) -> list[dict]:
-    if not intervals:
-        return []
-    sorted_i = sorted(intervals, key=lambda x: x["start"])
-    merged = [dict(sorted_i[0])]
-    for cur in sorted_i[1:]:
-        last = merged[-1]
-        if cur["start"] <= last["end"]:
-            last["end"] = max(last["end"], cur["end"])
-        else:
-            merged.append(dict(cur))
-    return merged
-
-
-def find_overlaps_within_layer(records: list) -> dict:
-    by_layer: dict = {}
-    for r in records:
-        by_layer.setdefault(r["layer"], []).append({"start": r["start"], "end": r["end"]})
+def _sort_by_layer(layer_ids: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> tuple:
+    """Sort by (layer, start) and shift every layer onto its own stretch of the number line.
+
+    After the shift no interval of one layer can reach the next layer's
+    intervals, so a single sweep over all layers never carries state across a
+    layer boundary. Callers subtract the returned shift again.
+    """
+    order = np.lexsort((starts, layer_ids))
+    layer_ids = layer_ids[order]
+    shift = layer_ids.astype(np.int64) * (int(ends.max()) + 1)
+    return layer_ids, starts[order] + shift, ends[order] + shift, shift
+
+
+def _merge_all_layers(layer_ids: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> tuple:
+    """Merge each layer's intervals into disjoint runs, sorted by (layer, start)."""
+    if not len(starts):
+        return layer_ids, starts, ends
+    layer_ids, starts, ends, shift = _sort_by_layer(layer_ids, starts, ends)
+    reach = np.maximum.accumulate(ends)
+    first = np.ones(len(starts), dtype=bool)
+    first[1:] = starts[1:] > reach[:-1]
+    last = np.append(first[1:], True)
+    return layer_ids[first], starts[first] - shift[first], reach[last] - shift[first]
+
+
+def _overlaps_all_layers(layer_ids: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> tuple:
+    """Merged runs covered at least twice within the same layer.
+
+    One sort plus a linear sweep, O(n log n) however dense the layers are. An
+    interval tree would still need a query per interval and would enumerate
+    every overlapping pair (O(n log n + k)), so it is not used here.
+    """
+    if len(starts) < 2:
+        return layer_ids[:0], starts[:0], ends[:0]
+    # Whatever part of an interval lies before the furthest end seen so far
+    # is covered at least twice.
+    layer_ids, starts, ends, shift = _sort_by_layer(layer_ids, starts, ends)
+    reach = np.maximum.accumulate(ends)
+    piece_ends = np.minimum(ends[1:], reach[:-1])
+    hit = starts[1:] < piece_ends
+    shift = shift[1:][hit]
+    return _merge_all_layers(layer_ids[1:][hit], starts[1:][hit] - shift, piece_ends[hit] - shift)
+
+
+def _gaps_all_layers(layer_ids: np.ndarray, starts: np.ndarray, ends: np.ndarray, lo: int, hi: int) -> tuple:
+    """Stretches of [lo, hi] not covered by each layer, sorted by (layer, start)."""
+    run_layers, run_starts, run_ends = _merge_all_layers(layer_ids, starts, ends)
+    first = np.ones(len(run_layers), dtype=bool)
+    first[1:] = run_layers[1:] != run_layers[:-1]
+    last = np.append(first[1:], True)
+    # A gap before every run (from lo or the previous run of the layer) and one after each layer's last run.
+    gap_layers = np.concatenate((run_layers, run_layers[last]))
+    gap_starts = np.concatenate((np.where(first, lo, np.roll(run_ends, 1)), run_ends[last]))
+    gap_ends = np.concatenate((run_starts, np.full(int(last.sum()), hi, dtype=np.int64)))
+    order = np.lexsort((gap_starts, gap_layers))
+    gap_layers, gap_starts, gap_ends = gap_layers[order], gap_starts[order], gap_ends[order]
+    hit = gap_starts < gap_ends
+    return gap_layers[hit], gap_starts[hit], gap_ends[hit]
+
+
+def _interval_dicts_by_layer(records: Records, run_layers: np.ndarray, run_starts: np.ndarray, run_ends: np.ndarray) -> dict:
+    present = np.unique(records.layer_ids)
+    lo = np.searchsorted(run_layers, present, side="left").tolist()
+    hi = np.searchsorted(run_layers, present, side="right").tolist()
+    # Convert to plain ints in one go; the UI formats these values one by one.
+    run_starts, run_ends = run_starts.tolist(), run_ends.tolist()
     result = {}
-    for layer, intervals in by_layer.items():
-        overlaps = []
-        for i in range(len(intervals)):
-            for j in range(i + 1, len(intervals)):
-                a, b = intervals[i], intervals[j]
-                start = max(a["start"], b["start"])
-                end = min(a["end"], b["end"])
-                if start < end:
-                    overlaps.append({"start": start, "end": end})
-        merged = merge_intervals(overlaps)
-        result[layer] = [{"start": m["start"], "end": m["end"], "len": m["end"] - m["start"]} for m in merged]
+    for layer_id, a, b in zip(present.tolist(), lo, hi):
+        result[records.layer_names[layer_id]] = [
+            {"start": s, "end": e, "len": e - s}
+            for s, e in zip(run_starts[a:b], run_ends[a:b])
+        ]
     return result
 
 
-def find_gaps_per_layer(records: list) -> dict:
-    min_start = min(r["start"] for r in records)
-    max_end = max(r["end"] for r in records)
-    by_layer: dict = {}
-    for r in records:
-        by_layer.setdefault(r["layer"], []).append({"start": r["start"], "end": r["end"]})
-    result = {}
-    for layer, intervals in by_layer.items():
-        merged = merge_intervals(intervals)
-        gaps = []
-        pos = min_start
-        for seg in merged:
-            if pos < seg["start"]:
-                gaps.append({"start": pos, "end": seg["start"], "len": seg["start"] - pos})
-            pos = max(pos, seg["end"])
-        if pos < max_end:
-            gaps.append({"start": pos, "end": max_end, "len": max_end - pos})
-        result[layer] = gaps
-    return result
+def find_overlaps_within_layer(records: Records) -> dict:
+    return _interval_dicts_by_layer(records, *_overlaps_all_layers(records.layer_ids, records.starts, records.ends))
+
+
+def find_gaps_per_layer(records: Records) -> dict:
+    min_start = int(records.starts.min())
+    max_end = int(records.ends.max())
+    return _interval_dicts_by_layer(
+        records, *_gaps_all_layers(records.layer_ids, records.starts, records.ends, min_start, max_end)
+    )
 
 
 def get_color(layer: str, index: int) -> str:
@@ -189,26 +288,31 @@ def build_chart_figure(segments: list, layers: list, chunks: list) -> go.Figure:
         for layer in layers:
             labels.append(f"{c}-{c + CHUNK_SIZE} | {layer}")
 
-    def row_index(chunk_start: int, layer: str) -> int:
-        return chunks.index(chunk_start) * len(layers) + layers.index(layer)
-
+    chunk_idx = {c: i for i, c in enumerate(chunks)}
     layer_idx = {l: i for i, l in enumerate(layers)}
 
-    fig = go.Figure()
+    # One bar trace per layer with a single colour; per-bar colour lists are validated bar by bar.
+    bars = {layer: {"x": [], "y": [], "base": [], "hovertext": []} for layer in layers}
     for seg in segments:
-        row_idx = row_index(seg["chunk_start"], seg["layer"])
-        y_label = labels[row_idx]
-        color = get_color(seg["layer"], layer_idx.get(seg["layer"], 0))
+        width = seg["rel_end"] - seg["rel_start"]
+        layer_bars = bars[seg["layer"]]
+        layer_bars["x"].append(width)
+        layer_bars["y"].append(labels[chunk_idx[seg["chunk_start"]] * len(layers) + layer_idx[seg["layer"]]])
+        layer_bars["base"].append(seg["rel_start"])
+        layer_bars["hovertext"].append(f"{seg['layer']}: {seg['abs_start']}–{seg['abs_end']} m ({width} m)")
+
+    fig = go.Figure()
+    for i, layer in enumerate(layers):
+        if not bars[layer]["x"]:
+            continue
+        color = get_color(layer, i)
         fig.add_trace(go.Bar(
-            name=seg["layer"],
-            x=[seg["rel_end"] - seg["rel_start"]],
-            y=[y_label],
-            base=[seg["rel_start"]],
+            name=layer,
+            **bars[layer],
             orientation="h",
             marker_color=color,
             marker_line_width=1,
             marker_line_color=color,
-            hovertext=f"{seg['layer']}: {seg['abs_start']}–{seg['abs_end']} m ({seg['rel_end'] - seg['rel_start']} m)",
             hoverinfo="text",
             showlegend=False,
         ))
@@ -236,44 +340,64 @@ def build_chart_figure(segments: list, layers: list, chunks: list) -> go.Figure:
     return fig
 
 
-def filter_records(records: list, filter_bills: list, filter_months: list) -> list:
-    out = []
-    for r in records:
-        if filter_bills and r.get("bill") and r["bill"] not in filter_bills:
-            continue
-        if filter_months and r.get("month") and r["month"] not in filter_months:
-            continue
-        out.append(r)
-    return out
-
-
-def compute_progress(records: list, route_extent: int) -> dict:
-    by_layer_intervals: dict = {}
-    by_bill_layer: dict = {}
-    for r in records:
-        if r["layer"] not in by_layer_intervals:
-            by_layer_intervals[r["layer"]] = []
-        by_layer_intervals[r["layer"]].append({"start": r["start"], "end": r["end"]})
-        if r.get("bill"):
-            key = f"{r['bill']}|{r['layer']}"
-            by_bill_layer[key] = by_bill_layer.get(key, 0) + (r["end"] - r["start"])
+@cache.memoize()
+def analyze_records(records: Records) -> tuple:
+    return build_stretch_segments(records), find_overlaps_within_layer(records), find_gaps_per_layer(records)
+
+
+@cache.memoize()
+def figure_json(records: Records) -> str:
+    stretch_data = analyze_records(records)[0]
+    fig = build_chart_figure(stretch_data["segments"], stretch_data["layers"], stretch_data["chunks"])
+    return pio.to_json(fig, validate=False)
+
+
+def _selected_ids(ids: np.ndarray, names: list, selected: list) -> np.ndarray:
+    # Rows without a value (id -1) are never filtered out.
+    index = {name: i for i, name in enumerate(names)}
+    selected_ids = [index[v] for v in selected if v in index]
+    return (ids < 0) | np.isin(ids, selected_ids)
+
+
+def filter_records(records: Records, filter_bills: list, filter_months: list) -> Records:
+    if not filter_bills and not filter_months:
+        return records
+    mask = np.ones(len(records), dtype=bool)
+    if filter_bills:
+        mask &= _selected_ids(records.bill_ids, records.bill_names, filter_bills)
+    if filter_months:
+        mask &= _selected_ids(records.month_ids, records.month_names, filter_months)
+    return records.subset(mask)
+
+
+@cache.memoize()
+def compute_progress(records: Records, route_extent: int) -> dict:
+    billed = records.bill_ids >= 0
+    by_bill_layer = (
+        pd.DataFrame({
+            "bill": records.bill_ids[billed],
+            "layer": records.layer_ids[billed],
+            "len": (records.ends - records.starts)[billed],
+        })
+        .groupby(["bill", "layer"], sort=True)["len"].sum()
+        .reset_index()
+    )
+    run_layers, run_starts, run_ends = _merge_all_layers(records.layer_ids, records.starts, records.ends)
+    layer_totals = np.zeros(len(records.layer_names), dtype=np.int64)
+    np.add.at(layer_totals, run_layers, run_ends - run_starts)
     per_layer = {}
-    for layer, intervals in by_layer_intervals.items():
-        merged = merge_intervals(intervals)
-        total = sum(m["end"] - m["start"] for m in merged)
-        per_layer[layer] = {"len": total, "pct": (total / route_extent * 100) if route_extent else 0}
-    all_intervals = [{"start": r["start"], "end": r["end"]} for r in records]
-    merged_all = merge_intervals(all_intervals)
-    overall_len = sum(m["end"] - m["start"] for m in merged_all)
+    for layer_id in np.unique(records.layer_ids).tolist():
+        total = int(layer_totals[layer_id])
+        per_layer[records.layer_names[layer_id]] = {"len": total, "pct": (total / route_extent * 100) if route_extent else 0}
+    _, run_starts, run_ends = _merge_all_layers(np.zeros_like(records.layer_ids), records.starts, records.ends)
+    overall_len = int((run_ends - run_starts).sum())
     overall_pct = (overall_len / route_extent * 100) if route_extent else 0
     per_layer_per_bill = []
-    for key, ln in by_bill_layer.items():
-        bill, layer = key.split("|", 1)
+    for bill_id, layer_id, ln in zip(by_bill_layer["bill"].tolist(), by_bill_layer["layer"].tolist(), by_bill_layer["len"].tolist()):
         per_layer_per_bill.append({
-            "bill": bill, "layer": layer, "len": ln,
+            "bill": records.bill_names[bill_id], "layer": records.layer_names[layer_id], "len": ln,
             "pct": (ln / route_extent * 100) if route_extent else 0,
         })
-    per_layer_per_bill.sort(key=lambda x: (x["bill"], x["layer"]))
     return {
         "route_extent": route_extent,
         "overall_len": overall_len,
@@ -390,14 +514,13 @@ app.layout = html.Div(
             ],
         ),
         dcc.Location(id="url", refresh=False),
-        dcc.Store(id="stored-data"),
         dcc.Store(id="records-store", data={}),
+        dcc.Store(id="last-input-hash"),
     ],
 )
 
 
 @callback(
-    Output("stored-data", "data"),
     Output("records-store", "data"),
     Output("output-container", "children"),
     Output("filter-bill", "options"),
@@ -405,6 +528,7 @@ app.layout = html.Div(
     Output("filter-bill", "value"),
     Output("filter-month", "value"),
     Output("progress-filters", "style"),
+    Output("last-input-hash", "data"),
     Input("url", "pathname"),
     Input("upload-data", "contents"),
     Input("load-sample", "n_clicks"),
@@ -413,16 +537,17 @@ app.layout = html.Div(
     State("filter-bill", "value"),
     State("filter-month", "value"),
     State("sample-file-dropdown", "value"),
+    State("last-input-hash", "data"),
     prevent_initial_call=False,
 )
-def process_upload(pathname, contents, n_clicks, apply_clicks, stored_records, filter_bill, filter_month, selected_file):
+def process_upload(pathname, contents, n_clicks, apply_clicks, stored_records, filter_bill, filter_month, selected_file, last_input_hash):
     ctx = dash.callback_context
     if not ctx.triggered:
         return dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update
     prop = ctx.triggered[0]["prop_id"]
     if "apply-progress-filter" in prop:
         pass
-    elif "load-sample" in prop or (prop == "url.pathname" and pathname and not stored_records.get("records") and DATA_FILES):
+    elif "load-sample" in prop or (prop == "url.pathname" and pathname and not stored_records.get("key") and DATA_FILES):
         filename = (selected_file or DEFAULT_DATA_FILE) or ""
         text = load_data_file(filename)
     elif contents:
@@ -430,30 +555,41 @@ def process_upload(pathname, contents, n_clicks, apply_clicks, stored_records, f
         text = base64.b64decode(content).decode("utf-8")
     else:
         return dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update
+    filter_bills = filter_bill if isinstance(filter_bill, list) else ([filter_bill] if filter_bill else [])
+    filter_months = filter_month if isinstance(filter_month, list) else ([filter_month] if filter_month else [])
+    # Skip duplicate triggers: same file reloaded, or Apply with unchanged filters.
+    if "apply-progress-filter" in prop:
+        effective_input = json.dumps([stored_records.get("key"), filter_bills, filter_months])
+    else:
+        effective_input = text
+    input_hash = hashlib.blake2b(effective_input.encode("utf-8"), digest_size=8).hexdigest()
+    if input_hash == last_input_hash:
+        raise PreventUpdate
     if "apply-progress-filter" not in prop:
         try:
-            records, route_extent = parse_csv(text)
-            if not records:
-                return None, {}, html.Div("No valid records found. Ensure Stretch uses format like 500-1000.", style={"color": "#f85149"}), [], [], [], [], {"display": "none"}
+            records = parse_csv(text)
+            route_extent = records.route_extent
+            if not len(records):
+                return {}, html.Div("No valid records found. Ensure Stretch uses format like 500-1000.", style={"color": "#f85149"}), [], [], [], [], {"display": "none"}, None
             all_records = records
             records = all_records
+            records_key = all_records.__caching_id__()
+            cache.set(f"records/{records_key}", all_records)
         except Exception as e:
-            return None, {}, html.Div(f"Error: {e}", style={"color": "#f85149"}), [], [], [], [], {"display": "none"}
+            return {}, html.Div(f"Error: {e}", style={"color": "#f85149"}), [], [], [], [], {"display": "none"}, None
     else:
-        all_records = stored_records.get("records", [])
+        if not stored_records.get("key"):
+            return dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update
+        records_key = stored_records["key"]
+        all_records = cache.get(f"records/{records_key}")
+        if all_records is None:
+            return {}, html.Div("Loaded data has expired. Please upload or load the data file again.", style={"color": "#f85149"}), [], [], [], [], {"display": "none"}, None
         route_extent = stored_records.get("route_extent", 8000)
-        filter_bills = filter_bill if isinstance(filter_bill, list) else ([filter_bill] if filter_bill else [])
-        filter_months = filter_month if isinstance(filter_month, list) else ([filter_month] if filter_month else [])
         records = filter_records(all_records, filter_bills, filter_months)
-    stretch_data = build_stretch_segments(all_records)
-    overlaps_within = find_overlaps_within_layer(all_records)
-    gaps = find_gaps_per_layer(all_records)
+    stretch_data, overlaps_within, gaps = analyze_records(all_records)
+    layer_idx = {l: i for i, l in enumerate(stretch_data["layers"])}
     progress_data = compute_progress(records, route_extent)
-    fig = build_chart_figure(
-        stretch_data["segments"],
-        stretch_data["layers"],
-        stretch_data["chunks"],
-    )
+    fig = json.loads(figure_json(all_records))
     legend_html = html.Div(
         style={"display": "flex", "gap": "20px", "flexWrap": "wrap", "marginTop": "16px", "fontSize": "0.85rem", "color": "#8b949e"},
         children=[
@@ -554,11 +690,11 @@ def process_upload(pathname, contents, n_clicks, apply_clicks, stored_records, f
             )
         )
     prog = progress_data
-    bills = sorted(set(r.get("bill") for r in all_records if r.get("bill")))
-    months = sorted(set(r.get("month") for r in all_records if r.get("month")))
-    month_labels = {m: f"{['Jan','Feb','Mar','Apr','May','Jun','Jul','Aug','Sep','Oct','Nov','Dec'][int(m.split('-')[1])-1]} {m.split('-')[0]}" for m in months}
-    filter_bill_val = filter_bill if isinstance(filter_bill, list) else ([filter_bill] if filter_bill else [])
-    filter_month_val = filter_month if isinstance(filter_month, list) else ([filter_month] if filter_month else [])
+    bills = all_records.bill_names
+    months = all_records.month_names
+    month_labels = {m: f"{_MONTH_ABBR[int(m[5:7]) - 1]} {m[:4]}" for m in months}
+    filter_bill_val = filter_bills
+    filter_month_val = filter_months
     filter_bill_opts = [{"label": b, "value": b} for b in bills]
     filter_month_opts = [{"label": month_labels.get(m, m), "value": m} for m in months]
     filters_style = {"display": "block", "marginBottom": "16px"} if (bills or months) else {"display": "none", "marginBottom": "16px"}
@@ -611,7 +747,7 @@ def process_upload(pathname, contents, n_clicks, apply_clicks, stored_records, f
                 continue
             bill_items = []
             for p in items:
-                li = stretch_data["layers"].index(p["layer"]) if p["layer"] in stretch_data["layers"] else 0
+                li = layer_idx.get(p["layer"], 0)
                 bill_items.append(
                     html.Div(
                         style={"marginBottom": "8px"},
@@ -652,8 +788,8 @@ def process_upload(pathname, contents, n_clicks, apply_clicks, stored_records, f
         children=analysis_panels,
     )
     output_children.append(analysis_div)
-    records_store_data = {"records": all_records, "route_extent": route_extent}
-    return stretch_data, records_store_data, html.Div(children=output_children), filter_bill_opts, filter_month_opts, filter_bill_val, filter_month_val, filters_style
+    records_store_data = {"key": records_key, "route_extent": route_extent}
+    return records_store_data, html.Div(children=output_children), filter_bill_opts, filter_month_opts, filter_bill_val, filter_month_val, filters_style, input_hash
 
 
 if __name__ == "__main__":
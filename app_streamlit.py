@@ -4,11 +4,11 @@ X-axis: 0-1000 m · Y-axis: chunks · Bars at stretch chainages · Overlap analy
 """
 
 import re
+import html
 import io
-from datetime import datetime
 from pathlib import Path
-from typing import Optional, Tuple
 
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
 import streamlit as st
@@ -19,33 +19,80 @@ LAYER_COLORS = {
     "Embankment EW": "#8957e5",
 }
 DEFAULT_COLORS = ["#238636", "#8957e5", "#1f6feb", "#d29922", "#db61a2"]
+# Fixed-height card style
+CARD_CSS = """
+<style>
+.layer-card {
+    background: #ffffff;
+    border: 1px solid #30363d;
+    border-radius: 12px;
+    padding: 16px;
+    height: 280px;
+    overflow-y: auto;
+    margin-bottom: 16px;
+}
+.layer-card h4 { margin: 0 0 12px 0; font-size: 1rem; }
+.layer-card .summary { 
+    display: flex; gap: 16px; margin-bottom: 12px; 
+    font-size: 0.9rem; color: #6e7681;
+}
+.layer-card .summary strong { color: #1f2328; }
+.layer-card ul { padding: 0 0 0 16px; margin: 0; font-size: 0.85rem; }
+.layer-card li { margin-bottom: 4px; }
+.layer-card .subsection { margin-bottom: 12px; }
+.layer-card .subsection-title { font-size: 0.8rem; color: #6e7681; margin: 0 0 6px 0; }
+</style>
+"""
+PROGRESS_CSS = """
+<style>
+.progress-label { margin: 0 0 4px 0; }
+.progress-track { height: 8px; border-radius: 4px; background: rgba(128,128,128,0.25); margin-bottom: 12px; }
+.progress-fill { height: 100%; border-radius: 4px; background: #ff4b4b; }
+</style>
+"""
 
 
-def parse_date(s: str) -> Optional[datetime]:
-    if not s or not isinstance(s, str):
-        return None
-    s = str(s).strip()
-    for fmt in ("%d.%m.%Y", "%d.%m.%y", "%d-%m-%Y", "%Y-%m-%d"):
-        try:
-            return datetime.strptime(s, fmt)
-        except ValueError:
-            continue
-    return None
+_DATE_RE = re.compile(r"^(\d{1,4})([-.])(\d{1,2})\2(\d{1,4})$")
+_MONTH_DAYS = np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+_MONTH_ABBR = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+_SEGMENT_FIELDS = ("chunk_start", "layer_ids", "rel_start", "rel_end", "abs_start", "abs_end")
+
+
+def parse_months(dates: pd.Series) -> pd.Series:
+    """Year-month ("YYYY-MM") of D.M.YYYY, D.M.YY, D-M-YYYY and YYYY-M-D dates; "" for anything else."""
+    parts = dates.str.extract(_DATE_RE).dropna()
+    first, sep, last = parts[0], parts[1], parts[3]
+    ymd = (first.str.len() == 4) & (sep == "-") & (last.str.len() <= 2)
+    dmy = (first.str.len() <= 2) & ((last.str.len() == 4) | ((sep == ".") & (last.str.len() == 2)))
+    year = last.where(dmy, first).astype(int)
+    month = parts[2].astype(int)
+    day = first.where(dmy, last).astype(int)
+    # Two-digit years follow strptime's %y: 69-99 -> 1900s, 00-68 -> 2000s.
+    short = dmy & (last.str.len() == 2)
+    year = year.where(~short, year + (year < 69) * 2000 + (year >= 69) * 1900)
+    leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    month_days = _MONTH_DAYS[(month - 1).clip(0, 11)] + (leap & (month == 2))
+    valid = (ymd | dmy) & (year >= 1) & month.between(1, 12) & (day >= 1) & (day <= month_days)
+    months = pd.Series("", index=dates.index, dtype=object)
+    months[valid[valid].index] = (
+        year[valid].astype(str).str.zfill(4) + "-" + month[valid].astype(str).str.zfill(2)
+    )
+    return months
+
+
+def _codes(values: np.ndarray) -> tuple[np.ndarray, list]:
+    codes, names = pd.factorize(np.where(values == "", None, values), sort=True)
+    return codes.astype(np.int32), names.tolist()
 
 
-def parse_stretch(s: str) -> Optional[Tuple[int, int]]:
-    if not s or not isinstance(s, str):
-        return None
-    m = re.match(r"^(\d+)\s*-\s*(\d+)$", str(s).strip())
-    if not m:
-        return None
-    start, end = int(m[1]), int(m[2])
-    return (start, end) if start <= end else None
+def _subset(records: dict, mask: np.ndarray) -> dict:
+    return {k: v[mask] if isinstance(v, np.ndarray) else v for k, v in records.items()}
 
 
+@st.cache_data
 def parse_csv(content: str):
-    df = pd.read_csv(io.StringIO(content))
-    cols = [c for c in df.columns if c]
+    header = pd.read_csv(io.StringIO(content), nrows=0)
+    cols = [c for c in header.columns if c]
     lower = [str(c).lower() for c in cols]
     item_idx = next((i for i, c in enumerate(lower) if c in ("item", "layer")), -1)
     stretch_idx = next((i for i, c in enumerate(lower) if c in ("stretch", "chainage")), -1)
@@ -54,156 +101,211 @@ def parse_csv(content: str):
     date_idx = next((i for i, c in enumerate(lower) if c in ("date", "end date")), -1)
     if item_idx < 0 or stretch_idx < 0:
         raise ValueError('CSV must have "Item" (or Layer) and "Stretch" columns')
-    records = []
+    # Only the needed columns, as plain strings; blank cells stay "" instead of NaN.
+    used = [cols[i] for i in (item_idx, stretch_idx, bill_idx, est_idx, date_idx) if i >= 0]
+    df = pd.read_csv(
+        io.StringIO(content), usecols=used, dtype=str, engine="c", keep_default_na=False, na_filter=False
+    )
+
+    def text_column(idx: int) -> pd.Series:
+        if idx < 0:
+            return pd.Series("", index=df.index, dtype=object)
+        return df[cols[idx]].str.strip()
+
+    out = pd.DataFrame({"layer": text_column(item_idx), "bill": text_column(bill_idx)})
+    spans = text_column(stretch_idx).str.extract(r"^(\d+)\s*-\s*(\d+)$")
+    out["start"] = pd.to_numeric(spans[0], errors="coerce")
+    out["end"] = pd.to_numeric(spans[1], errors="coerce")
+    out["month"] = ""
+    if date_idx >= 0:
+        out["month"] = parse_months(text_column(date_idx))
+    out["est"] = 0
+    if est_idx >= 0:
+        est_text = df[cols[est_idx]].str.replace(",", "", regex=False)
+        out["est"] = pd.to_numeric(est_text, errors="coerce").fillna(0)
+    out = out.dropna(subset=["start", "end"])
+    out = out[(out["layer"] != "") & (out["start"] <= out["end"])].astype({"start": "int64", "end": "int64"})
+
     route_extent = 0
-    for _, row in df.iterrows():
-        item = str(row.iloc[item_idx] or "").strip()
-        stretch = str(row.iloc[stretch_idx] or "").strip()
-        if not item or not stretch:
-            continue
-        span = parse_stretch(stretch)
-        if not span:
-            continue
-        rec = {"layer": item, "start": span[0], "end": span[1]}
-        if bill_idx >= 0:
-            bill = str(row.iloc[bill_idx] or "").strip()
-            if bill:
-                rec["bill"] = bill
-        if est_idx >= 0:
-            try:
-                est = int(str(row.iloc[est_idx] or "0").replace(",", ""))
-                if est > 0:
-                    route_extent = est
-            except (ValueError, TypeError):
-                pass
-        if date_idx >= 0:
-            dt = parse_date(str(row.iloc[date_idx] or ""))
-            if dt:
-                rec["month"] = f"{dt.year}-{dt.month:02d}"
-        records.append(rec)
-    if not route_extent and records:
-        route_extent = max(r["end"] for r in records) - min(r["start"] for r in records)
+    given = out["est"][out["est"] > 0]
+    if len(given):
+        route_extent = int(given.iloc[-1])
+    elif len(out):
+        route_extent = int(out["end"].max() - out["start"].min())
+    # Parallel arrays; *_ids index into the sorted *_names lists (-1 = blank).
+    layer_ids, layer_names = _codes(out["layer"].to_numpy())
+    bill_ids, bill_names = _codes(out["bill"].to_numpy())
+    month_ids, month_names = _codes(out["month"].to_numpy())
+    records = {
+        "starts": out["start"].to_numpy(),
+        "ends": out["end"].to_numpy(),
+        "layer_ids": layer_ids,
+        "bill_ids": bill_ids,
+        "month_ids": month_ids,
+        "layer_names": layer_names,
+        "bill_names": bill_names,
+        "month_names": month_names,
+        "month_labels": {m: f"{_MONTH_ABBR[int(m[5:7]) - 1]} {m[:4]}" for m in month_names},
+    }
     return records, route_extent or 8000
 
 
-def build_stretch_segments(records: list[dict]) -> dict:
-    segments = []
-    layers = set()
-    chunks = set()
-
-    for r in records:
-        layers.add(r["layer"])
-        c_start = (r["start"] // CHUNK_SIZE) * CHUNK_SIZE
-        c_end = (r["end"] // CHUNK_SIZE) * CHUNK_SIZE
-        c = c_start
-        while c <= c_end:
-            chunks.add(c)
-            seg_start = max(r["start"], c)
-            seg_end = min(r["end"], c + CHUNK_SIZE)
-            if seg_start < seg_end:
-                rel_start = seg_start - c
-                rel_end = seg_end - c
-                segments.append({
-                    "chunk_start": c,
-                    "chunk_label": f"{c}-{c + CHUNK_SIZE}",
-                    "layer": r["layer"],
-                    "rel_start": rel_start,
-                    "rel_end": rel_end,
-                    "abs_start": seg_start,
-                    "abs_end": seg_end,
-                })
-            c += CHUNK_SIZE
-
-    segments.sort(key=lambda s: (s["chunk_start"], s["layer"], s["rel_start"]))
-    layers = sorted(layers)
-    chunks = sorted(chunks)
+@st.cache_data
+def build_stretch_segments(records: dict) -> dict:
+    starts, ends = records["starts"], records["ends"]
+    if not len(starts):
+        empty = np.zeros(0, dtype=np.int64)
+        return {"segments": {k: empty for k in _SEGMENT_FIELDS}, "layers": [], "chunks": []}
+    present, layer_ids = np.unique(records["layer_ids"], return_inverse=True)
+    layers = [records["layer_names"][i] for i in present.tolist()]
+
+    # Expand each record into one row per chunk it touches.
+    c_start = (starts // CHUNK_SIZE) * CHUNK_SIZE
+    c_end = (ends // CHUNK_SIZE) * CHUNK_SIZE
+    lengths = (c_end - c_start) // CHUNK_SIZE + 1
+    rec_idx = np.repeat(np.arange(len(starts)), lengths)
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    c = c_start[rec_idx] + offsets * CHUNK_SIZE
+    chunks = np.unique(c).tolist()
+
+    seg_start = np.maximum(starts[rec_idx], c)
+    seg_end = np.minimum(ends[rec_idx], c + CHUNK_SIZE)
+    keep = seg_start < seg_end
+    c, seg_start, seg_end, seg_layer = c[keep], seg_start[keep], seg_end[keep], layer_ids[rec_idx][keep]
+    order = np.lexsort((seg_start - c, seg_layer, c))
+    c, seg_start, seg_end = c[order], seg_start[order], seg_end[order]
+
+    # Parallel arrays sorted by (chunk, layer, start); layer_ids index into layers.
+    segments = {
+        "chunk_start": c,
+        "layer_ids": seg_layer[order],
+        "rel_start": seg_start - c,
+        "rel_end": seg_end - c,
+        "abs_start": seg_start,
+        "abs_end": seg_end,
+    }
     return {"segments": segments, "layers": layers, "chunks": chunks}
 
 
-def merge_intervals(intervals: list[dict]) -> list[dict]:
-    if not intervals:
-        return []
-    sorted_i = sorted(intervals, key=lambda x: x["start"])
-    merged = [dict(sorted_i[0])]
-    for cur in sorted_i[1:]:
-        last = merged[-1]
-        if cur["start"] <= last["end"]:
-            last["end"] = max(last["end"], cur["end"])
-        else:
-            merged.append(dict(cur))
-    return merged
-
-
-def find_overlaps_within_layer(records: list) -> dict:
-    by_layer: dict = {}
-    for r in records:
-        by_layer.setdefault(r["layer"], []).append({"start": r["start"], "end": r["end"]})
+def _sort_by_layer(layer_ids: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> tuple:
+    """Sort by (layer, start) and shift every layer onto its own stretch of the number line.
+
+    After the shift no interval of one layer can reach the next layer's
+    intervals, so a single sweep over all layers never carries state across a
+    layer boundary. Callers subtract the returned shift again.
+    """
+    order = np.lexsort((starts, layer_ids))
+    layer_ids = layer_ids[order]
+    shift = layer_ids.astype(np.int64) * (int(ends.max()) + 1)
+    return layer_ids, starts[order] + shift, ends[order] + shift, shift
+
+
+def _merge_all_layers(layer_ids: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> tuple:
+    """Merge each layer's intervals into disjoint runs, sorted by (layer, start)."""
+    if not len(starts):
+        return layer_ids, starts, ends
+    layer_ids, starts, ends, shift = _sort_by_layer(layer_ids, starts, ends)
+    reach = np.maximum.accumulate(ends)
+    first = np.ones(len(starts), dtype=bool)
+    first[1:] = starts[1:] > reach[:-1]
+    last = np.append(first[1:], True)
+    return layer_ids[first], starts[first] - shift[first], reach[last] - shift[first]
+
+
+def _overlaps_all_layers(layer_ids: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> tuple:
+    """Merged runs covered at least twice within the same layer."""
+    if len(starts) < 2:
+        return layer_ids[:0], starts[:0], ends[:0]
+    # Whatever part of an interval lies before the furthest end seen so far
+    # is covered at least twice.
+    layer_ids, starts, ends, shift = _sort_by_layer(layer_ids, starts, ends)
+    reach = np.maximum.accumulate(ends)
+    piece_ends = np.minimum(ends[1:], reach[:-1])
+    hit = starts[1:] < piece_ends
+    shift = shift[1:][hit]
+    return _merge_all_layers(layer_ids[1:][hit], starts[1:][hit] - shift, piece_ends[hit] - shift)
+
+
+def _gaps_all_layers(layer_ids: np.ndarray, starts: np.ndarray, ends: np.ndarray, lo: int, hi: int) -> tuple:
+    """Stretches of [lo, hi] not covered by each layer, sorted by (layer, start)."""
+    run_layers, run_starts, run_ends = _merge_all_layers(layer_ids, starts, ends)
+    first = np.ones(len(run_layers), dtype=bool)
+    first[1:] = run_layers[1:] != run_layers[:-1]
+    last = np.append(first[1:], True)
+    # A gap before every run (from lo or the previous run of the layer) and one after each layer's last run.
+    gap_layers = np.concatenate((run_layers, run_layers[last]))
+    gap_starts = np.concatenate((np.where(first, lo, np.roll(run_ends, 1)), run_ends[last]))
+    gap_ends = np.concatenate((run_starts, np.full(int(last.sum()), hi, dtype=np.int64)))
+    order = np.lexsort((gap_starts, gap_layers))
+    gap_layers, gap_starts, gap_ends = gap_layers[order], gap_starts[order], gap_ends[order]
+    hit = gap_starts < gap_ends
+    return gap_layers[hit], gap_starts[hit], gap_ends[hit]
+
+
+def _interval_dicts_by_layer(records: dict, run_layers: np.ndarray, run_starts: np.ndarray, run_ends: np.ndarray) -> dict:
+    present = np.unique(records["layer_ids"])
+    lo = np.searchsorted(run_layers, present, side="left").tolist()
+    hi = np.searchsorted(run_layers, present, side="right").tolist()
+    run_starts, run_ends = run_starts.tolist(), run_ends.tolist()
     result = {}
-    for layer, intervals in by_layer.items():
-        overlaps = []
-        for i in range(len(intervals)):
-            for j in range(i + 1, len(intervals)):
-                a, b = intervals[i], intervals[j]
-                start = max(a["start"], b["start"])
-                end = min(a["end"], b["end"])
-                if start < end:
-                    overlaps.append({"start": start, "end": end})
-        merged = merge_intervals(overlaps)
-        result[layer] = [{"start": m["start"], "end": m["end"], "len": m["end"] - m["start"]} for m in merged]
+    for layer_id, a, b in zip(present.tolist(), lo, hi):
+        result[records["layer_names"][layer_id]] = [
+            {"start": s, "end": e, "len": e - s} for s, e in zip(run_starts[a:b], run_ends[a:b])
+        ]
     return result
 
 
-def find_gaps_per_layer(records: list) -> dict:
-    min_start = min(r["start"] for r in records)
-    max_end = max(r["end"] for r in records)
-    by_layer: dict = {}
-    for r in records:
-        by_layer.setdefault(r["layer"], []).append({"start": r["start"], "end": r["end"]})
-    result = {}
-    for layer, intervals in by_layer.items():
-        merged = merge_intervals(intervals)
-        gaps = []
-        pos = min_start
-        for seg in merged:
-            if pos < seg["start"]:
-                gaps.append({"start": pos, "end": seg["start"], "len": seg["start"] - pos})
-            pos = max(pos, seg["end"])
-        if pos < max_end:
-            gaps.append({"start": pos, "end": max_end, "len": max_end - pos})
-        result[layer] = gaps
-    return result
+@st.cache_data
+def find_overlaps_within_layer(records: dict) -> dict:
+    return _interval_dicts_by_layer(records, *_overlaps_all_layers(records["layer_ids"], records["starts"], records["ends"]))
+
+
+@st.cache_data
+def find_gaps_per_layer(records: dict) -> dict:
+    min_start = int(records["starts"].min())
+    max_end = int(records["ends"].max())
+    return _interval_dicts_by_layer(
+        records, *_gaps_all_layers(records["layer_ids"], records["starts"], records["ends"], min_start, max_end)
+    )
 
 
 def get_color(layer: str, index: int) -> str:
     return LAYER_COLORS.get(layer, DEFAULT_COLORS[index % len(DEFAULT_COLORS)])
 
 
-def build_chart_figure(segments: list, layers: list, chunks: list) -> go.Figure:
+def build_chart_figure(segments: dict, layers: list, chunks: list) -> go.Figure:
     labels = []
     for c in chunks:
         for layer in layers:
             labels.append(f"{c}-{c + CHUNK_SIZE} | {layer}")
 
-    def row_index(chunk_start: int, layer: str) -> int:
-        return chunks.index(chunk_start) * len(layers) + layers.index(layer)
-
-    layer_idx = {l: i for i, l in enumerate(layers)}
+    seg_layers = segments["layer_ids"]
+    rows = np.searchsorted(chunks, segments["chunk_start"]) * len(layers) + seg_layers
+    y_labels = np.array(labels, dtype=object)[rows]
+    widths = segments["rel_end"] - segments["rel_start"]
 
+    # One bar trace per layer; plotly draws a trace with many bars far faster than many traces.
     fig = go.Figure()
-    for seg in segments:
-        row_idx = row_index(seg["chunk_start"], seg["layer"])
-        y_label = labels[row_idx]
-        color = get_color(seg["layer"], layer_idx.get(seg["layer"], 0))
+    for i, layer in enumerate(layers):
+        mask = seg_layers == i
+        if not mask.any():
+            continue
+        color = get_color(layer, i)
         fig.add_trace(go.Bar(
-            name=seg["layer"],
-            x=[seg["rel_end"] - seg["rel_start"]],
-            y=[y_label],
-            base=[seg["rel_start"]],
+            name=layer,
+            x=widths[mask],
+            y=y_labels[mask],
+            base=segments["rel_start"][mask],
             orientation="h",
             marker_color=color,
             marker_line_width=1,
             marker_line_color=color,
-            hovertext=f"{seg['layer']}: {seg['abs_start']}–{seg['abs_end']} m ({seg['rel_end'] - seg['rel_start']} m)",
+            hovertext=[
+                f"{layer}: {s}–{e} m ({w} m)"
+                for s, e, w in zip(
+                    segments["abs_start"][mask].tolist(), segments["abs_end"][mask].tolist(), widths[mask].tolist()
+                )
+            ],
             hoverinfo="text",
             showlegend=False,
         ))
@@ -231,44 +333,49 @@ def build_chart_figure(segments: list, layers: list, chunks: list) -> go.Figure:
     return fig
 
 
-def filter_records(records: list, filter_bills: list, filter_months: list) -> list:
-    out = []
-    for r in records:
-        if filter_bills and r.get("bill") and r["bill"] not in filter_bills:
-            continue
-        if filter_months and r.get("month") and r["month"] not in filter_months:
-            continue
-        out.append(r)
-    return out
-
-
-def compute_progress(records: list, route_extent: int) -> dict:
-    by_layer_intervals: dict = {}
-    by_bill_layer: dict = {}
-    for r in records:
-        if r["layer"] not in by_layer_intervals:
-            by_layer_intervals[r["layer"]] = []
-        by_layer_intervals[r["layer"]].append({"start": r["start"], "end": r["end"]})
-        if r.get("bill"):
-            key = f"{r['bill']}|{r['layer']}"
-            by_bill_layer[key] = by_bill_layer.get(key, 0) + (r["end"] - r["start"])
+def _selected(ids: np.ndarray, names: list, selected: list) -> np.ndarray:
+    # Rows without a value (id -1) are never filtered out.
+    index = {name: i for i, name in enumerate(names)}
+    return (ids < 0) | np.isin(ids, [index[v] for v in selected if v in index])
+
+
+def filter_records(records: dict, filter_bills: list, filter_months: list) -> dict:
+    if not filter_bills and not filter_months:
+        return records
+    mask = np.ones(len(records["starts"]), dtype=bool)
+    if filter_bills:
+        mask &= _selected(records["bill_ids"], records["bill_names"], filter_bills)
+    if filter_months:
+        mask &= _selected(records["month_ids"], records["month_names"], filter_months)
+    return _subset(records, mask)
+
+
+@st.cache_data
+def compute_progress(records: dict, route_extent: int) -> dict:
+    starts, ends, layer_ids = records["starts"], records["ends"], records["layer_ids"]
+    layer_names, bill_names = records["layer_names"], records["bill_names"]
+    # One combined (bill, layer) key per billed record; np.unique keeps them sorted by bill, then layer.
+    billed = records["bill_ids"] >= 0
+    pair_keys = records["bill_ids"][billed].astype(np.int64) * len(layer_names) + layer_ids[billed]
+    pairs, inverse = np.unique(pair_keys, return_inverse=True)
+    pair_lens = np.bincount(inverse, weights=(ends - starts)[billed], minlength=len(pairs)).astype(np.int64)
+    run_layers, run_starts, run_ends = _merge_all_layers(layer_ids, starts, ends)
+    totals = np.zeros(len(layer_names), dtype=np.int64)
+    np.add.at(totals, run_layers, run_ends - run_starts)
     per_layer = {}
-    for layer, intervals in by_layer_intervals.items():
-        merged = merge_intervals(intervals)
-        total = sum(m["end"] - m["start"] for m in merged)
-        per_layer[layer] = {"len": total, "pct": (total / route_extent * 100) if route_extent else 0}
-    all_intervals = [{"start": r["start"], "end": r["end"]} for r in records]
-    merged_all = merge_intervals(all_intervals)
-    overall_len = sum(m["end"] - m["start"] for m in merged_all)
+    for layer_id in np.unique(layer_ids).tolist():
+        total = int(totals[layer_id])
+        per_layer[layer_names[layer_id]] = {"len": total, "pct": (total / route_extent * 100) if route_extent else 0}
+    _, run_starts, run_ends = _merge_all_layers(np.zeros_like(layer_ids), starts, ends)
+    overall_len = int((run_ends - run_starts).sum())
     overall_pct = (overall_len / route_extent * 100) if route_extent else 0
     per_layer_per_bill = []
-    for key, ln in by_bill_layer.items():
-        bill, layer = key.split("|", 1)
+    for pair, ln in zip(pairs.tolist(), pair_lens.tolist()):
+        bill_id, layer_id = divmod(pair, len(layer_names))
         per_layer_per_bill.append({
-            "bill": bill, "layer": layer, "len": ln,
+            "bill": bill_names[bill_id], "layer": layer_names[layer_id], "len": ln,
             "pct": (ln / route_extent * 100) if route_extent else 0,
         })
-    per_layer_per_bill.sort(key=lambda x: (x["bill"], x["layer"]))
     return {
         "route_extent": route_extent,
         "overall_len": overall_len,
@@ -278,6 +385,15 @@ def compute_progress(records: list, route_extent: int) -> dict:
     }
 
 
+def progress_bar_html(label: str, pct: float) -> str:
+    # label is inserted as HTML; callers escape any layer or bill names in it.
+    return (
+        f'<p class="progress-label">{label}</p>'
+        f'<div class="progress-track"><div class="progress-fill" style="width: {min(100.0, pct):.1f}%"></div></div>'
+    )
+
+
+@st.cache_data(ttl=60)
 def get_available_data_files() -> list[Path]:
     """Return list of CSV files in the project directory."""
     project_dir = Path(__file__).parent
@@ -299,6 +415,7 @@ st.caption("X-axis: 0–1000 · Y-axis: chunks · Overlap & gap analysis per lay
 if "records" not in st.session_state:
     st.session_state.records = None
     st.session_state.route_extent = 8000
+    st.session_state.records_key = None
 if "ignore_upload" not in st.session_state:
     st.session_state.ignore_upload = False
 
@@ -312,6 +429,7 @@ if st.session_state.records is None and data_files:
         records, route_extent = parse_csv(text)
         st.session_state.records = records
         st.session_state.route_extent = route_extent
+        st.session_state.records_key = hash(text)
         st.rerun()
     except Exception:
         pass  # Fall through to show upload UI
@@ -340,6 +458,7 @@ with col2:
                 records, route_extent = parse_csv(text)
                 st.session_state.records = records
                 st.session_state.route_extent = route_extent
+                st.session_state.records_key = hash(text)
                 st.session_state.ignore_upload = True
                 st.rerun()
             except Exception as e:
@@ -351,6 +470,7 @@ with col2:
                 records, route_extent = parse_csv(text)
                 st.session_state.records = records
                 st.session_state.route_extent = route_extent
+                st.session_state.records_key = hash(text)
                 st.session_state.ignore_upload = True
                 st.rerun()
             except Exception as e:
@@ -362,21 +482,22 @@ if uploaded_file and not st.session_state.ignore_upload:
         records, route_extent = parse_csv(text)
         st.session_state.records = records
         st.session_state.route_extent = route_extent
+        st.session_state.records_key = hash(text)
     except Exception as e:
         st.error(str(e))
         st.stop()
 st.session_state.ignore_upload = False
 
 all_records = st.session_state.records
-if not all_records:
+if all_records is None or not len(all_records["starts"]):
     st.info("📂 Upload a CSV or load a data file to get started.")
     st.stop()
 
 route_extent = st.session_state.route_extent
 
-bills = sorted(set(r.get("bill") for r in all_records if r.get("bill")))
-months = sorted(set(r.get("month") for r in all_records if r.get("month")))
-month_labels = {m: f"{['Jan','Feb','Mar','Apr','May','Jun','Jul','Aug','Sep','Oct','Nov','Dec'][int(m.split('-')[1])-1]} {m.split('-')[0]}" for m in months}
+bills = all_records["bill_names"]
+months = all_records["month_names"]
+month_labels = all_records["month_labels"]
 
 filter_bills = []
 filter_months = []
@@ -391,38 +512,48 @@ if bills or months:
 
 records = filter_records(all_records, filter_bills, filter_months)
 
-stretch_data = build_stretch_segments(all_records)
-overlaps_within = find_overlaps_within_layer(all_records)
-gaps = find_gaps_per_layer(all_records)
+# The chart, overlaps and gaps ignore the filters; only redo them when other data is loaded.
+if st.session_state.get("analysis_key") != st.session_state.records_key:
+    stretch_data = build_stretch_segments(all_records)
+    st.session_state.analysis = (
+        stretch_data,
+        find_overlaps_within_layer(all_records),
+        find_gaps_per_layer(all_records),
+        build_chart_figure(stretch_data["segments"], stretch_data["layers"], stretch_data["chunks"]),
+    )
+    st.session_state.analysis_key = st.session_state.records_key
+stretch_data, overlaps_within, gaps, fig = st.session_state.analysis
+layer_colors = [get_color(l, i) for i, l in enumerate(stretch_data["layers"])]
 progress_data = compute_progress(records, route_extent)
-fig = build_chart_figure(
-    stretch_data["segments"],
-    stretch_data["layers"],
-    stretch_data["chunks"],
-)
 
 st.subheader("X-axis: 0–1000 · Y-axis: chunks × layers (one row per layer per chunk)")
 st.plotly_chart(fig, use_container_width=True)
 
 legend_cols = st.columns(min(5, len(stretch_data["layers"])))
+legend_items = [[] for _ in legend_cols]
 for i, layer in enumerate(stretch_data["layers"]):
-    with legend_cols[i % 5]:
-        st.markdown(f"<span style='display:inline-block;width:14px;height:14px;background:{get_color(layer, i)};border-radius:4px;vertical-align:middle;margin-right:6px;'></span> {layer}", unsafe_allow_html=True)
+    legend_items[i % 5].append(f"<span style='display:inline-block;width:14px;height:14px;background:{layer_colors[i]};border-radius:4px;vertical-align:middle;margin-right:6px;'></span> {layer}")
+for col, items in zip(legend_cols, legend_items):
+    col.markdown("<br>".join(items), unsafe_allow_html=True)
 
 st.divider()
 
 st.subheader("Progress")
-st.caption(f"{len(records)} of {len(all_records)} records")
+st.caption(f"{len(records['starts'])} of {len(all_records['starts'])} records")
 
 prog = progress_data
-st.markdown(f"**Overall** · {prog['overall_len']:.0f} m / {prog['route_extent']} m · {prog['overall_pct']:.1f}%")
-st.progress(min(1.0, prog["overall_pct"] / 100))
-
-st.markdown("**Per layer**")
+# All bars go out in one markdown element instead of a text and a progress element per layer.
+bars = [
+    progress_bar_html(
+        f"<strong>Overall</strong> · {prog['overall_len']:.0f} m / {prog['route_extent']} m · {prog['overall_pct']:.1f}%",
+        prog["overall_pct"],
+    ),
+    "<p><strong>Per layer</strong></p>",
+]
 for i, layer in enumerate(stretch_data["layers"]):
     d = prog["per_layer"].get(layer, {"pct": 0})
-    st.markdown(f"{layer} · {d['pct']:.1f}%")
-    st.progress(min(1.0, d["pct"] / 100))
+    bars.append(progress_bar_html(f"{html.escape(layer)} · {d['pct']:.1f}%", d["pct"]))
+st.markdown(PROGRESS_CSS + "".join(bars), unsafe_allow_html=True)
 
 if prog["per_layer_per_bill"]:
     st.markdown("**Per layer in each bill**")
@@ -431,70 +562,50 @@ if prog["per_layer_per_bill"]:
         if not items:
             continue
         with st.expander(bill):
-            for p in items:
-                st.markdown(f"{p['layer']} · {p['pct']:.1f}%")
-                st.progress(min(1.0, p["pct"] / 100))
+            st.markdown("".join(progress_bar_html(f"{html.escape(p['layer'])} · {p['pct']:.1f}%", p["pct"]) for p in items), unsafe_allow_html=True)
 
 st.divider()
 st.subheader("Overlap & gap analysis")
 
-# Fixed-height card style
-st.markdown("""
-<style>
-.layer-card {
-    background: #ffffff;
-    border: 1px solid #30363d;
-    border-radius: 12px;
-    padding: 16px;
-    height: 280px;
-    overflow-y: auto;
-    margin-bottom: 16px;
-}
-.layer-card h4 { margin: 0 0 12px 0; font-size: 1rem; }
-.layer-card .summary { 
-    display: flex; gap: 16px; margin-bottom: 12px; 
-    font-size: 0.9rem; color: #6e7681;
-}
-.layer-card .summary strong { color: #1f2328; }
-.layer-card ul { padding: 0 0 0 16px; margin: 0; font-size: 0.85rem; }
-.layer-card li { margin-bottom: 4px; }
-.layer-card .subsection { margin-bottom: 12px; }
-.layer-card .subsection-title { font-size: 0.8rem; color: #6e7681; margin: 0 0 6px 0; }
-</style>
-""", unsafe_allow_html=True)
+# Streamlit clears anything a rerun does not draw again, so the style is emitted on every run.
+st.markdown(CARD_CSS, unsafe_allow_html=True)
 
 cols = st.columns(min(3, len(stretch_data["layers"])))
+cards = [[] for _ in cols]
 for i, layer in enumerate(stretch_data["layers"]):
-    with cols[i % 3]:
-        ov_within = overlaps_within.get(layer, [])
-        gs = gaps.get(layer, [])
-        total_overlap_len = sum(o["len"] for o in ov_within)
-        total_gap_len = sum(g["len"] for g in gs)
-        color = get_color(layer, i)
-
-        overlaps_list = "".join(
-            f"<li><code>{o['start']}–{o['end']} m</code> · {o['len']} m</li>"
-            for o in ov_within
-        ) or "<li class='empty'>None</li>"
-        gaps_list = "".join(
-            f"<li><code>{g['start']}–{g['end']} m</code> · {g['len']} m</li>"
-            for g in gs
-        ) or "<li class='empty'>None</li>"
-
-        st.markdown(f"""
-        <div class="layer-card" style="border-left: 3px solid {color}">
-            <h4>{layer}</h4>
-            <div class="summary">
-                <span><strong>Overlaps:</strong> {total_overlap_len} m</span>
-                <span><strong>Gaps:</strong> {total_gap_len} m</span>
-            </div>
-            <div class="subsection">
-                <p class="subsection-title">Overlaps within layer ({len(ov_within)})</p>
-                <ul>{overlaps_list}</ul>
-            </div>
-            <div class="subsection">
-                <p class="subsection-title">Gaps ({len(gs)})</p>
-                <ul>{gaps_list}</ul>
-            </div>
+    ov_within = overlaps_within.get(layer, [])
+    gs = gaps.get(layer, [])
+    total_overlap_len = sum(o["len"] for o in ov_within)
+    total_gap_len = sum(g["len"] for g in gs)
+    color = layer_colors[i]
+
+    overlaps_list = "".join(
+        f"<li><code>{o['start']}–{o['end']} m</code> · {o['len']} m</li>"
+        for o in ov_within
+    ) or "<li class='empty'>None</li>"
+    gaps_list = "".join(
+        f"<li><code>{g['start']}–{g['end']} m</code> · {g['len']} m</li>"
+        for g in gs
+    ) or "<li class='empty'>None</li>"
+
+    cards[i % 3].append(f"""
+    <div class="layer-card" style="border-left: 3px solid {color}">
+        <h4>{layer}</h4>
+        <div class="summary">
+            <span><strong>Overlaps:</strong> {total_overlap_len} m</span>
+            <span><strong>Gaps:</strong> {total_gap_len} m</span>
+        </div>
+        <div class="subsection">
+            <p class="subsection-title">Overlaps within layer ({len(ov_within)})</p>
+            <ul>{overlaps_list}</ul>
         </div>
-        """, unsafe_allow_html=True)
+        <div class="subsection">
+            <p class="subsection-title">Gaps ({len(gs)})</p>
+            <ul>{gaps_list}</ul>
+        </div>
+    </div>
+    """)
+
+# One markdown element per column rather than one per card.
+for col, col_cards in zip(cols, cards):
+    col.markdown("".join(col_cards), unsafe_allow_html=True)